@@ -0,0 +1,65 @@
+# conftest.py: shared pytest fixtures for the scraper tests.
+
+import sys
+import types
+from unittest.mock import AsyncMock, MagicMock
+import pytest
+from aiolimiter import AsyncLimiter
+import novel_utils
+from novel_utils import LLM_REQUESTS_PER_MINUTE
+
+# test_api.py is a live API check that runs on import, not a unit test, so a
+# bare "pytest" skips it the same way the Makefile's explicit file list does.
+collect_ignore = ["test_api.py"]
+
+# Stand-in for the Gemini SDK, registered before anything imports scraper, so
+# the real google.generativeai never initializes during unit tests.
+genai_stub = types.ModuleType("google.generativeai")
+genai_stub.configure = lambda **kwargs: None
+genai_stub.GenerativeModel = lambda *args, **kwargs: MagicMock()
+sys.modules["google.generativeai"] = genai_stub
+
+
+@pytest.fixture(scope="session")
+def scraper_mod():
+    """Imports scraper once for the whole test session."""
+    import scraper
+
+    return scraper
+
+
+@pytest.fixture(scope="session")
+def scraper_cli_mod():
+    """Imports scraper_cli once for the whole test session."""
+    import scraper_cli
+
+    return scraper_cli
+
+
+@pytest.fixture(scope="session")
+def shared_llm_model(scraper_mod):
+    """Installs one mock model as scraper.llm_model for the whole session."""
+    model = MagicMock()
+    model.generate_content_async = AsyncMock()
+    # The monkeypatch fixture is function-scoped, so the session gets its own
+    with pytest.MonkeyPatch.context() as session_monkeypatch:
+        session_monkeypatch.setattr(scraper_mod, "llm_model", model)
+        yield model
+
+
+@pytest.fixture
+def llm_model(shared_llm_model, scraper_mod, monkeypatch):
+    """Resets the shared mock model; each test gets an empty cache and new limiter."""
+    # Only the API call is reset in full; clearing return values on the model
+    # itself would also break magic methods such as __bool__.
+    shared_llm_model.reset_mock()
+    shared_llm_model.generate_content_async.reset_mock(
+        return_value=True, side_effect=True
+    )
+    monkeypatch.setattr(novel_utils, "llm_cache", {})
+    # Each test runs its own event loop, and a limiter is bound to the first
+    # loop it is used on.
+    monkeypatch.setattr(
+        scraper_mod, "llm_limiter", AsyncLimiter(LLM_REQUESTS_PER_MINUTE, 60)
+    )
+    return shared_llm_model
@@ -0,0 +1,289 @@
+## novel_utils.py: config and helpers shared by scraper.py and scraper_cli.py.
+
+from curl_cffi import CurlHttpVersion, requests as curl_requests
+import asyncio
+import hashlib
+import random
+import re
+import os
+import json
+from aiolimiter import AsyncLimiter
+from diskcache import Cache
+
+try:
+    # google-re2 is a linear-time, drop-in engine for the cleanup regex
+    import re2 as cleanup_re
+except ImportError:
+    cleanup_re = re
+
+try:
+    # orjson serializes the manifests in C, straight to UTF-8 bytes
+    import orjson
+except ImportError:
+    orjson = None
+
+__all__ = [
+    "CHAPTER_ARCHIVE_URL",
+    "CONTENT_START",
+    "CONTENT_END",
+    "HTTP_MAX_CLIENTS",
+    "RETRY_STATUS_CODES",
+    "MAX_RETRIES",
+    "MAX_BACKOFF_SECONDS",
+    "EDITING_PROMPT",
+    "LLM_MODEL_NAME",
+    "LLM_REQUESTS_PER_MINUTE",
+    "LLM_CACHE_DIR",
+    "PROMO_RE",
+    "llm_limiter",
+    "get_llm_cache",
+    "get_http_session",
+    "close_http_session",
+    "get_llm_model",
+    "retry_with_backoff",
+    "is_retryable_fetch_error",
+    "is_retryable_llm_error",
+    "read_chapter_page",
+    "sanitize_filename",
+    "basic_clean_text",
+    "llm_cache_key",
+    "llm_chapter_cache_key",
+    "dump_json",
+    "load_json",
+    "chunk_text",
+]
+
+# --- CONFIGURATION ---
+# novelbin fills the TOC's "#list-chapter" tab from this endpoint
+CHAPTER_ARCHIVE_URL = "https://novelbin.com/ajax/chapter-archive?novelId={}"
+# Everything read from a chapter page comes before the "Next" link under the
+# text, so read_chapter_page aborts the transfer there instead of pulling in
+# the comments and footer.
+CONTENT_START = b'id="chr-content"'
+CONTENT_END = b'id="next_chap"'
+# Requests the shared session keeps in flight. They share one HTTP/2
+# connection, so a handful of streams is enough to keep it busy.
+HTTP_MAX_CLIENTS = 8
+# Rate limits (429) and server errors (5xx) from novelbin or the Gemini API
+# are retried with exponential backoff plus jitter.
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5  # Attempts per request, including the first
+MAX_BACKOFF_SECONDS = 60
+# The prompt for the LLM. Be very specific about what you want.
+# It is set as the model's system instruction, which keeps the instructions
+# apart from the chapter text instead of pasting the two together. The
+# instruction is still sent (and billed) with every request.
+EDITING_PROMPT = """
+You are an expert editor for web novels. Please proofread and lightly edit the text you are given.
+Your tasks are:
+1. Correct spelling mistakes, grammatical errors, and typos.
+2. Fix awkward phrasing to improve readability, but preserve the original author's style.
+3. Ensure consistent formatting for dialogue (e.g., using "quotation marks").
+4. DO NOT add, remove, or change any story content, plot points, or character names.
+5. DO NOT add any introductory or concluding remarks of your own.
+Return only the edited text.
+"""
+
+# --- LLM CONFIGURATION ---
+LLM_MODEL_NAME = "gemini-2.5-flash-preview-05-20"
+# Requests per minute allowed against the Gemini API (free tier)
+LLM_REQUESTS_PER_MINUTE = 10
+llm_limiter = AsyncLimiter(LLM_REQUESTS_PER_MINUTE, 60)
+
+# Edited chunks keyed by a hash of model + prompt + chunk, so re-runs of
+# either script skip the API for text that was already edited.
+LLM_CACHE_DIR = ".llm_cache"
+
+llm_cache = None  # Opened on first use by get_llm_cache()
+llm_model = None  # Created on first use by get_llm_model()
+http_session = None  # Created on first use by get_http_session()
+
+# --- SHARED CLIENTS ---
+
+
+def get_http_session():
+    """Returns the shared HTTP session, creating it on first use."""
+    global http_session
+    if http_session is None:
+        http_session = curl_requests.AsyncSession(
+            impersonate="chrome120",
+            timeout=30,
+            http_version=CurlHttpVersion.V2_0,
+            max_clients=HTTP_MAX_CLIENTS,
+        )
+    return http_session
+
+
+async def close_http_session():
+    """Closes the shared HTTP session if one was created."""
+    global http_session
+    if http_session is not None:
+        await http_session.close()
+        http_session = None
+
+
+def get_llm_cache():
+    """Returns the shared LLM edit cache, opening it on first use."""
+    global llm_cache
+    if llm_cache is None:
+        llm_cache = Cache(LLM_CACHE_DIR)
+    return llm_cache
+
+
+def get_llm_model():
+    """Returns the shared Gemini model, or None if no API key is set."""
+    global llm_model
+    if llm_model is None:
+        api_key = os.getenv("KUCING_NAKAL_GOOGLE_API_KEY")
+        if not api_key:
+            return None
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        llm_model = genai.GenerativeModel(
+            LLM_MODEL_NAME, system_instruction=EDITING_PROMPT
+        )
+    return llm_model
+
+
+# --- HELPER FUNCTIONS ---
+
+
+# Waits between retries; a module attribute so tests can swap out just this
+# sleep without touching asyncio.sleep for the whole event loop.
+backoff_sleep = asyncio.sleep
+
+
+async def retry_with_backoff(make_call, is_retryable):
+    """Awaits make_call(), retrying retryable errors with exponential backoff."""
+    for attempt in range(MAX_RETRIES):
+        try:
+            return await make_call()
+        except Exception as e:
+            if attempt == MAX_RETRIES - 1 or not is_retryable(e):
+                raise
+            delay = min(MAX_BACKOFF_SECONDS, 2**attempt + random.random())
+            print(f"    > Retrying in {delay:.1f}s after error: {e}")
+            await backoff_sleep(delay)
+
+
+def is_retryable_fetch_error(error):
+    """Retries dropped connections and 429/5xx responses."""
+    if not isinstance(error, curl_requests.errors.RequestsError):
+        return False
+    return error.response is None or error.response.status_code in RETRY_STATUS_CODES
+
+
+def is_retryable_llm_error(error):
+    """Retries the Gemini API's rate limit and server errors."""
+    # google.api_core errors carry the HTTP status as .code
+    return getattr(error, "code", None) in RETRY_STATUS_CODES
+
+
+async def read_chapter_page(session, chapter_url):
+    """Streams a chapter page, stopping once the chapter text has arrived."""
+    body = bytearray()
+    content_start = -1
+    async with session.stream("GET", chapter_url) as chapter_page:
+        chapter_page.raise_for_status()
+        async for chunk in chapter_page.aiter_content():
+            # Only rescan the new bytes, plus enough overlap for a marker
+            # split across two chunks.
+            scan_from = max(len(body) - max(len(CONTENT_START), len(CONTENT_END)), 0)
+            body += chunk
+            if content_start < 0:
+                content_start = body.find(CONTENT_START, scan_from)
+                scan_from = content_start
+            if content_start >= 0 and body.find(CONTENT_END, scan_from) >= 0:
+                # Leaving the "async with" only waits for the transfer to end;
+                # quit_now makes curl abort it on the next write instead.
+                chapter_page.quit_now.set()
+                break
+    return bytes(body)
+
+
+# Deletes the characters that are invalid in Windows/Mac/Linux filenames
+INVALID_FILENAME_CHARS = str.maketrans("", "", '\\/*?:"<>|')
+
+# Every character stdlib re's \s matches in str patterns. RE2's \s is ASCII
+# only, so the promo tails list them all (including &nbsp;, which Lexbor turns
+# into U+00A0) to clean text the same way with either engine.
+UNICODE_WHITESPACE = (
+    "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000-\u200a"
+    "\u2028\u2029\u202f\u205f\u3000"
+)
+
+# novelbin promo lines and the inline ad block, fused so the chapter text is
+# scanned once. Scoped flags keep each branch's original case/dot rules.
+PROMO_RE = cleanup_re.compile(
+    rf"(?i:Read latest Chapters at novelbin\.com Only[.,!{UNICODE_WHITESPACE}]*)"
+    rf"|(?i:This chapter is updated by novelbin\.com[.,!{UNICODE_WHITESPACE}]*)"
+    # The non-greedy branch removes the ad block specifically
+    r"|(?s:Enhance your reading experience.*?Remove Ads From \$1)"
+)
+
+
+def sanitize_filename(name):
+    """Removes invalid characters for filenames."""
+    name = name.translate(INVALID_FILENAME_CHARS)
+    # Also remove a period from the start of a filename
+    name = name.removeprefix(".")
+    # Reduce runs of whitespace to one space
+    return " ".join(name.split())
+
+
+def basic_clean_text(text):
+    """Performs basic, non-LLM cleaning."""
+    return PROMO_RE.sub("", text).strip()
+
+
+def llm_cache_key(text_chunk):
+    """Hashes a chunk with the model and prompt that would edit it."""
+    return hashlib.blake2b(
+        f"{LLM_MODEL_NAME}|{EDITING_PROMPT}|{text_chunk}".encode("utf-8"),
+        digest_size=16,
+    ).hexdigest()
+
+
+def llm_chapter_cache_key(text):
+    """Keys a whole chapter's edit, one level above the per-chunk entries."""
+    return "chapter:" + llm_cache_key(text)
+
+
+def dump_json(obj):
+    """Serializes obj as indented UTF-8 JSON bytes."""
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+    return json.dumps(obj, indent=2, ensure_ascii=False).encode("utf-8")
+
+
+def load_json(data):
+    """Parses JSON from bytes."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+
+def chunk_text(text, max_chars=4000):
+    """Splits text into chunks for LLM processing."""
+    if len(text) <= max_chars:
+        return [text]
+    # Cut at the last paragraph break that keeps the chunk within max_chars,
+    # slicing straight out of the text instead of splitting it into a list.
+    # Each cut removes exactly one "\n\n", so "\n\n".join(chunks) == text.
+    chunks, start, end = [], 0, len(text)
+    while True:
+        if end - start <= max_chars:
+            chunks.append(text[start:])
+            return chunks
+        cut = text.rfind("\n\n", start, start + max_chars + 2)
+        if cut < 0:
+            # A paragraph longer than max_chars becomes a chunk of its own
+            cut = text.find("\n\n", start + max_chars)
+            if cut < 0:
+                chunks.append(text[start:])
+                return chunks
+        # Cut at the start of a longer blank run, as str.split("\n\n") would;
+        # its extra newlines open the next chunk, so spacing is kept.
+        while cut > start and text[cut - 1] == "\n":
+            cut -= 1
+        chunks.append(text[start:cut])
+        start = cut + 2
@@ -1,14 +1,35 @@
 ## Full scraper.py with chapter splitting, curl-cffi, and all advanced features.
 
 from curl_cffi import requests as curl_requests
-from bs4 import BeautifulSoup
+import asyncio
+import hashlib
 import time
-import re
 import os
 import json
-import git
-import google.generativeai as genai
+import aiofiles
+import subprocess
+from lxml import etree, html as lxml_html
+from selectolax.lexbor import LexborHTMLParser
 from urllib.parse import urljoin
+from novel_utils import (
+    CHAPTER_ARCHIVE_URL,
+    llm_limiter,
+    get_llm_cache,
+    get_http_session,
+    close_http_session,
+    get_llm_model,
+    retry_with_backoff,
+    is_retryable_fetch_error,
+    is_retryable_llm_error,
+    read_chapter_page,
+    sanitize_filename,
+    basic_clean_text,
+    llm_cache_key,
+    llm_chapter_cache_key,
+    dump_json,
+    load_json,
+    chunk_text,
+)
 
 # --- CONFIGURATION ---
 REPO_PATH = "."
@@ -17,87 +38,62 @@ NOVEL_URLS = [
     "https://novelbin.com/n/supreme-magus-novel/",
     # Add other novel URLs here, e.g., "https://novelbin.com/n/shadow-slave-novel/"
 ]
+# Compiled once; each pulls exactly what it needs out of the main/TOC page
+NOVEL_TITLE_XPATH = etree.XPath(
+    '//h3[contains(concat(" ", normalize-space(@class), " "), " title ")]'
+)
+NOVEL_ID_XPATH = etree.XPath(
+    '//span[contains(concat(" ", normalize-space(@class), " "), " nchr-text ")]'
+    "[@data-chapter_id]/@data-novel_id"
+)
+CHAPTER_LINKS_XPATH = etree.XPath(
+    '//ul[contains(concat(" ", normalize-space(@class), " "), " list-chapter ")]'
+    "//a/@href"
+)
+# Maximum number of chapter pages fetched at the same time
+CONCURRENCY = 8
 USE_LLM_CLEANUP = True
-# The prompt for the LLM. Be very specific about what you want.
-EDITING_PROMPT = """
-You are an expert editor for web novels. Please proofread and lightly edit the following text.
-Your tasks are:
-1. Correct spelling mistakes, grammatical errors, and typos.
-2. Fix awkward phrasing to improve readability, but preserve the original author's style.
-3. Ensure consistent formatting for dialogue (e.g., using "quotation marks").
-4. DO NOT add, remove, or change any story content, plot points, or character names.
-5. DO NOT add any introductory or concluding remarks of your own.
-Return only the edited text.
-
-Here is the text:
----
-{}
-"""
 
 # --- LLM CONFIGURATION ---
-if USE_LLM_CLEANUP:
-    API_KEY = os.getenv("KUCING_NAKAL_GOOGLE_API_KEY")
-    if not API_KEY:
-        llm_model = None
-    else:
-        genai.configure(api_key=API_KEY)
-        llm_model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20")
-else:
-    llm_model = None
+# Created on first use, so importing scraper never loads the Gemini SDK
+llm_model = None
 
 # --- HELPER FUNCTIONS ---
 
 
-def sanitize_filename(name):
-    """Removes invalid characters for filenames."""
-    # Remove characters that are invalid in Windows/Mac/Linux filenames
-    name = re.sub(r'[\\/*?:"<>|]', "", name)
-    # Also remove periods from the start of a filename
-    name = re.sub(r"^\.", "", name)
-    # Reduce multiple spaces to one
-    name = re.sub(r"\s+", " ", name).strip()
-    return name
-
-
-def basic_clean_text(text):
-    """Performs basic, non-LLM cleaning."""
-    text = re.sub(
-        r"Read latest Chapters at novelbin\.com Only[.,!\s]*",
-        "",
-        text,
-        flags=re.IGNORECASE,
-    )
-    text = re.sub(
-        r"This chapter is updated by novelbin\.com[.,!\s]*",
-        "",
-        text,
-        flags=re.IGNORECASE,
-    )
-    # The non-greedy regex to remove the ad block specifically
-    text = re.sub(
-        r"Enhance your reading experience.*?Remove Ads From \$1",
-        "",
-        text,
-        flags=re.DOTALL,
-    )
-    return text.strip()
+def init_llm_model():
+    """Returns the Gemini model, creating it on first use."""
+    global llm_model
+    if llm_model is None and USE_LLM_CLEANUP:
+        llm_model = get_llm_model()
+    return llm_model
 
 
-def llm_edit_text(text_chunk):
+async def llm_edit_text(text_chunk):
     """Sends a chunk of text to the LLM for editing."""
     if not text_chunk.strip():
         return ""
-    if not llm_model:
+    model = init_llm_model()
+    if not model:
         raise ConnectionError("LLM model not configured.")
 
+    llm_cache = get_llm_cache()
+    cache_key = llm_cache_key(text_chunk)
+    if cache_key in llm_cache:
+        return llm_cache[cache_key]
+
     print("    > Sending chunk to LLM for editing...")
+
+    async def generate():
+        async with llm_limiter:  # Respect free tier rate limits
+            return await model.generate_content_async(
+                text_chunk, request_options={"timeout": 120}
+            )
+
     try:
-        full_prompt = EDITING_PROMPT.format(text_chunk)
-        response = llm_model.generate_content(
-            full_prompt, request_options={"timeout": 120}
-        )
-        time.sleep(1.5)  # Respect free tier rate limits
+        response = await retry_with_backoff(generate, is_retryable_llm_error)
         if response.parts:
+            llm_cache[cache_key] = response.text
             return response.text
         else:
             print("    > WARNING: LLM returned no content. Returning original chunk.")
@@ -107,124 +103,220 @@ def llm_edit_text(text_chunk):
         return text_chunk
 
 
-def chunk_text(text, max_chars=4000):
-    """Splits text into chunks for LLM processing."""
-    if len(text) <= max_chars:
-        return [text]
-    chunks, paragraphs, current_chunk = [], text.split("\n\n"), ""
-    for paragraph in paragraphs:
-        if len(current_chunk) + len(paragraph) + 2 <= max_chars:
-            current_chunk += ("\n\n" if current_chunk else "") + paragraph
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = paragraph
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+async def llm_edit_chapter(text):
+    """Edits every chunk of a chapter; returns the text and whether all were edited."""
+    # A chapter edited before (a duplicate page, or a re-run) skips chunking
+    llm_cache = get_llm_cache()
+    chapter_key = llm_chapter_cache_key(text)
+    if chapter_key in llm_cache:
+        return llm_cache[chapter_key], True
+
+    text_chunks = chunk_text(text)
+    edited_chunks = await asyncio.gather(*(llm_edit_text(c) for c in text_chunks))
+    edited_text = "\n\n".join(edited_chunks)
+    # Only remember the chapter if no chunk fell back to its original text
+    fully_edited = all(
+        not c.strip() or llm_cache_key(c) in llm_cache for c in text_chunks
+    )
+    if fully_edited:
+        llm_cache[chapter_key] = edited_text
+    return edited_text, fully_edited
 
 
 # --- CORE SCRAPING LOGIC ---
 
 
-def scrape_novel(novel_url):
+def load_previous_manifest(manifest_filepath):
+    """Returns the last run's manifest entries keyed by chapter URL."""
+    if not os.path.exists(manifest_filepath):
+        return {}
+    with open(manifest_filepath, "rb") as f:
+        try:
+            chapter_manifest = load_json(f.read())
+        except json.JSONDecodeError:
+            print("Warning: Manifest file is corrupted. Starting from scratch.")
+            return {}
+    # Older manifests have no URL or hash; those chapters are simply redone
+    return {entry["url"]: entry for entry in chapter_manifest if "url" in entry}
+
+
+async def fetch_chapter(session, semaphore, chapter_url):
+    """Fetches one chapter page and returns its title and cleaned text."""
+    async with semaphore:
+        print(f"Scraping chapter: {chapter_url}")
+        try:
+            chapter_html = await retry_with_backoff(
+                lambda: read_chapter_page(session, chapter_url),
+                is_retryable_fetch_error,
+            )
+        except curl_requests.errors.RequestsError as e:
+            print(f"Could not fetch {chapter_url}: {e}")
+            return "Untitled Chapter", None
+
+    tree = LexborHTMLParser(chapter_html)
+
+    title_element = tree.css_first("a.chr-title")
+    chapter_title = (
+        (title_element.attributes.get("title") or "Untitled Chapter").strip()
+        if title_element
+        else "Untitled Chapter"
+    )
+
+    content_div = tree.css_first("#chr-content")
+    if not content_div:
+        print(f"Could not find content for {chapter_url}.")
+        return chapter_title, None
+
+    # Drop inline ad scripts/styles so their source doesn't end up in the text
+    content_div.strip_tags(["script", "style"])
+    raw_text = content_div.text(separator="\n")
+    return chapter_title, basic_clean_text(raw_text)
+
+
+def is_saved(entry, novel_folder, number):
+    """Checks that a previous manifest entry still matches a file on disk."""
+    # A chapter saved without a complete LLM edit (an API failure, or a run
+    # without a key) is redone, so the edit is retried on the next run.
+    if USE_LLM_CLEANUP and not entry.get("edited"):
+        return False
+    return entry["number"] == number and os.path.exists(
+        os.path.join(novel_folder, entry["file"])
+    )
+
+
+async def scrape_chapter(
+    session,
+    semaphore,
+    novel_folder,
+    number,
+    chapter_url,
+    previous_entry=None,
+    refetch=False,
+):
+    """Fetches and saves one chapter, returning its manifest entry."""
+    # Already saved by an earlier run: resume without fetching it again
+    if (
+        previous_entry
+        and not refetch
+        and is_saved(previous_entry, novel_folder, number)
+    ):
+        return previous_entry
+
+    chapter_title, cleaned_text = await fetch_chapter(session, semaphore, chapter_url)
+    if cleaned_text is None:
+        return None
+
+    encoded_text = cleaned_text.encode("utf-8")
+    text_hash = hashlib.blake2b(encoded_text, digest_size=16).hexdigest()
+    # Same text as last run: keep the saved (possibly LLM-edited) file as is
+    if (
+        previous_entry
+        and previous_entry.get("hash") == text_hash
+        and is_saved(previous_entry, novel_folder, number)
+    ):
+        return previous_entry
+
+    # The LLM pass runs outside the semaphore so edits of earlier chapters
+    # overlap with fetches of later ones; llm_limiter paces the API calls.
+    edited = USE_LLM_CLEANUP  # An empty chapter has nothing left to edit
+    if USE_LLM_CLEANUP and cleaned_text.strip():
+        print(f"    > Processing with LLM cleanup: {chapter_title}")
+        final_text, edited = await llm_edit_chapter(cleaned_text)
+        encoded_text = final_text.encode("utf-8")
+
+    safe_chapter_title = sanitize_filename(chapter_title)
+    chapter_filename = f"{str(number).zfill(4)}-{safe_chapter_title}.txt"
+    chapter_filepath = os.path.join(novel_folder, chapter_filename)
+
+    # Written as soon as the chapter is ready, without blocking the event loop
+    async with aiofiles.open(chapter_filepath, "wb") as f:
+        await f.write(encoded_text)
+
+    return {
+        "number": number,
+        "title": chapter_title,
+        "file": chapter_filename,
+        "url": chapter_url,
+        "hash": text_hash,
+        "edited": edited,
+    }
+
+
+async def scrape_novel(novel_url, session):
     """Scrapes an entire novel, saving each chapter as a separate file."""
     try:
-        session = curl_requests.Session(impersonate="chrome120", timeout=30)
         print(f"Attempting to fetch main page with curl-cffi: {novel_url}")
-        main_page = session.get(novel_url)
+        main_page = await session.get(novel_url)
         main_page.raise_for_status()
-        soup = BeautifulSoup(main_page.content, "html.parser")
+        main_tree = lxml_html.fromstring(main_page.content)
 
-        novel_title = soup.find("h3", class_="title").text.strip()
+        novel_title = NOVEL_TITLE_XPATH(main_tree)[0].text_content().strip()
         novel_folder = sanitize_filename(novel_title)
         os.makedirs(novel_folder, exist_ok=True)
         print(f"--- Starting scrape for: {novel_title} ---")
         print(f"--- Saving chapters to folder: '{novel_folder}/' ---")
 
-        first_chapter_span = soup.select_one(
-            "span.nchr-text[data-novel_id][data-chapter_id]"
-        )
-        if not first_chapter_span:
-            print("Could not find the first chapter's data-span. Exiting.")
+        novel_ids = NOVEL_ID_XPATH(main_tree)
+        if not novel_ids or not novel_ids[0]:
+            print(
+                "Could not find the novel id in the first chapter's data-span. Exiting."
+            )
             return
 
-        novel_id = first_chapter_span.get("data-novel_id")
-        chapter_id = first_chapter_span.get("data-chapter_id")
-        if not novel_id or not chapter_id:
-            print("Found the span, but it's missing data. Exiting.")
+        # Collect every chapter URL up front so the pages can be fetched
+        # concurrently instead of hopping from one "Next" link to the next.
+        archive_page = await session.get(CHAPTER_ARCHIVE_URL.format(novel_ids[0]))
+        archive_page.raise_for_status()
+        chapter_urls = [
+            urljoin(novel_url, href)
+            for href in CHAPTER_LINKS_XPATH(lxml_html.fromstring(archive_page.content))
+        ]
+        if not chapter_urls:
+            print("Could not find any chapters in the table of contents. Exiting.")
             return
-        current_chapter_url = f"https://novelbin.com/b/{novel_id}/{chapter_id}"
-        print(f"  (Manually constructed first chapter URL: {current_chapter_url})")
-
-        chapter_count = 0
-        chapter_manifest = []
-
-        while current_chapter_url:
-            if not current_chapter_url.startswith(("http://", "https://")):
-                current_chapter_url = urljoin(novel_url, current_chapter_url)
-
-            print(f"Scraping chapter: {current_chapter_url}")
-            chapter_page = session.get(current_chapter_url)
-            chapter_page.raise_for_status()
-            chapter_soup = BeautifulSoup(chapter_page.content, "html.parser")
-
-            title_element = chapter_soup.find("a", class_="chr-title")
-            chapter_title = (
-                title_element.get("title", "Untitled Chapter").strip()
-                if title_element
-                else "Untitled Chapter"
-            )
+        print(f"  (Found {len(chapter_urls)} chapters in the table of contents)")
 
-            safe_chapter_title = sanitize_filename(chapter_title)
-            chapter_filename = (
-                f"{str(chapter_count + 1).zfill(4)}-{safe_chapter_title}.txt"
-            )
-            chapter_filepath = os.path.join(novel_folder, chapter_filename)
-
-            content_div = chapter_soup.find(id="chr-content")
-            if content_div:
-                raw_text = content_div.get_text(separator="\n")
-                cleaned_text = basic_clean_text(raw_text)
-
-                final_text = cleaned_text  # Default to cleaned text
-                if USE_LLM_CLEANUP and cleaned_text.strip():
-                    print("    > Processing with LLM cleanup...")
-                    text_chunks = chunk_text(cleaned_text)
-                    edited_chunks = [llm_edit_text(chunk) for chunk in text_chunks]
-                    final_text = "\n\n".join(edited_chunks)
-
-                with open(chapter_filepath, "w", encoding="utf-8") as f:
-                    f.write(final_text)
-
-                chapter_manifest.append(
-                    {
-                        "number": chapter_count + 1,
-                        "title": chapter_title,
-                        "file": chapter_filename,
-                    }
+        manifest_filepath = os.path.join(novel_folder, "manifest.json")
+        previous_entries = load_previous_manifest(manifest_filepath)
+        # The newest saved chapter is fetched again in case its text was
+        # still being updated; scrape_chapter's hash check keeps its file
+        # when nothing changed.
+        tail_url = next(reversed(previous_entries), None)
+        if previous_entries:
+            print(f"  (Resuming: {len(previous_entries)} chapters already saved)")
+
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        entries = [None] * len(chapter_urls)
+
+        async def scrape_into_entries(index, url):
+            """Scrapes one chapter, logging an error instead of raising it."""
+            try:
+                entries[index] = await scrape_chapter(
+                    session,
+                    semaphore,
+                    novel_folder,
+                    index + 1,
+                    url,
+                    previous_entries.get(url),
+                    refetch=url == tail_url,
                 )
-            else:
-                print(f"Could not find content for {current_chapter_url}.")
-
-            chapter_count += 1
-
-            next_link_element = chapter_soup.find(id="next_chap")
-            if next_link_element and "disabled" not in next_link_element.get(
-                "class", []
-            ):
-                current_chapter_url = next_link_element.get("href")
-            else:
-                print("Last chapter reached.")
-                current_chapter_url = None
+            except Exception as e:
+                print(f"Could not save chapter {index + 1} ({url}): {e}")
 
-            time.sleep(1)
-
-        manifest_filepath = os.path.join(novel_folder, "manifest.json")
-        with open(manifest_filepath, "w", encoding="utf-8") as f:
-            json.dump(chapter_manifest, f, indent=2)
+        try:
+            await asyncio.gather(
+                *(scrape_into_entries(i, url) for i, url in enumerate(chapter_urls))
+            )
+        finally:
+            # Chapters finished before a failure or interruption still make it
+            # into the manifest, so the next run resumes after them.
+            chapter_manifest = [entry for entry in entries if entry]
+            with open(manifest_filepath, "wb") as f:
+                f.write(dump_json(chapter_manifest))
 
-        print(f"--- Finished: Scraped {chapter_count} chapters for {novel_title} ---")
+        print(
+            f"--- Finished: Scraped {len(chapter_urls)} chapters for {novel_title} ---"
+        )
 
     except curl_requests.errors.RequestsError as e:
         print(f"A web request error occurred: {e}")
@@ -239,56 +331,73 @@ def update_main_manifest():
     """Creates a main manifest listing all valid novel FOLDERS."""
     print("Updating main manifest file...")
     # Find directories that contain a 'manifest.json' file, ignoring hidden ones.
-    novels = [
-        d
-        for d in os.listdir(REPO_PATH)
-        if os.path.isdir(os.path.join(REPO_PATH, d))
-        and not d.startswith((".", "venv"))
-        and os.path.exists(os.path.join(REPO_PATH, d, "manifest.json"))
-    ]
+    # scandir's entries carry the file type, so only folders that pass the
+    # name filter cost a stat for their manifest.
+    with os.scandir(REPO_PATH) as entries:
+        novels = [
+            entry.name
+            for entry in entries
+            if entry.is_dir(follow_symlinks=False)
+            and not entry.name.startswith((".", "venv"))
+            and os.path.exists(os.path.join(entry.path, "manifest.json"))
+        ]
     manifest_path = os.path.join(REPO_PATH, "manifest.json")
-    with open(manifest_path, "w") as f:
-        json.dump(novels, f, indent=2)
+    with open(manifest_path, "wb") as f:
+        f.write(dump_json(novels))
     print("Main manifest updated successfully.")
 
 
 def git_commit_and_push():
     """Commits and pushes changes to the git repository."""
     try:
-        repo = git.Repo(REPO_PATH)
-        if not repo.is_dirty(untracked_files=True):
-            print("No changes to commit. Repository is up-to-date.")
-            return
-
         print("Adding all changes to git...")
-        repo.git.add(A=True)
+        subprocess.run(["git", "-C", REPO_PATH, "add", "-A"], check=True)
 
         commit_message = f"Update novels - {time.strftime('%Y-%m-%d %H:%M:%S')}"
-        repo.index.commit(commit_message)
+        # No separate dirty check: git commit exits non-zero (and says why)
+        # when there is nothing to commit.
+        result = subprocess.run(
+            ["git", "-C", REPO_PATH, "commit", "-m", commit_message]
+        )
+        if result.returncode != 0:
+            print("Nothing was committed. Skipping push.")
+            return
         print(f"Committed changes: {commit_message}")
 
-        origin = repo.remote(name="origin")
         print("Pushing changes to remote repository...")
-        origin.push()
+        subprocess.run(["git", "-C", REPO_PATH, "push", "origin", "HEAD"], check=True)
         print("Push successful.")
 
-    except git.exc.InvalidGitRepositoryError:
-        print("Not a git repository. Skipping git operations.")
-    except Exception as e:
+    except FileNotFoundError:
+        print("git executable not found. Skipping git operations.")
+    except subprocess.CalledProcessError as e:
         print(f"Git operation failed: {e}")
 
 
 # --- MAIN EXECUTION BLOCK ---
 
+
+async def scrape_all():
+    """Scrapes every configured novel on a single event loop and session."""
+    # llm_limiter is bound to the loop it is first used on, so all novels
+    # share one loop instead of one asyncio.run() each. Sharing the session
+    # also reuses its HTTP/2 connection across novels.
+    session = get_http_session()
+    try:
+        for url in NOVEL_URLS:
+            await scrape_novel(url, session)
+    finally:
+        await close_http_session()
+
+
 if __name__ == "__main__":
-    if USE_LLM_CLEANUP and not llm_model:
+    if USE_LLM_CLEANUP and not init_llm_model():
         print(
             "WARNING: LLM cleanup is enabled but model is not configured. Skipping LLM pass."
         )
         USE_LLM_CLEANUP = False
 
-    for url in NOVEL_URLS:
-        scrape_novel(url)
+    asyncio.run(scrape_all())
 
     update_main_manifest()
     git_commit_and_push()
@@ -2,20 +2,47 @@
 # A flexible CLI for downloading and processing web novels with resume capability.
 
 import os
-import re
 import json
+import tempfile
 import time
+import asyncio
 import argparse
-import git
+import subprocess
 import random
 from curl_cffi import requests as curl_requests
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
+from selectolax.lexbor import LexborHTMLParser
 from urllib.parse import urljoin
+from novel_utils import (
+    CHAPTER_ARCHIVE_URL,
+    llm_limiter,
+    get_llm_cache,
+    get_http_session,
+    close_http_session,
+    get_llm_model,
+    retry_with_backoff,
+    is_retryable_fetch_error,
+    is_retryable_llm_error,
+    read_chapter_page,
+    sanitize_filename,
+    basic_clean_text,
+    llm_cache_key,
+    llm_chapter_cache_key,
+    dump_json,
+    load_json,
+    chunk_text,
+)
 
 # --- CONFIGURATION ---
 REPO_PATH = "."
-EDITING_PROMPT = """..."""  # Your full prompt here
+CONCURRENCY = 8  # Chapter pages in flight at once
+BATCH_SIZE = 32  # Chapters fetched together before they are saved in order
+MANIFEST_SAVE_EVERY = 10  # New chapters between manifest rewrites
+# Only the tags each page is read for are parsed into the tree
+MAIN_PAGE_STRAINER = SoupStrainer(["h3", "span"])
+ARCHIVE_STRAINER = SoupStrainer("ul", class_="list-chapter")
 llm_model = None  # Will be initialized if needed
+LLM_FILE_CONCURRENCY = 4  # Chapter files edited at once by the "llm" action
 
 
 # --- HELPER FUNCTIONS ---
@@ -24,81 +51,71 @@ def initialize_llm():
     global llm_model
     if llm_model:
         return True
-    API_KEY = os.getenv("KUCING_NAKAL_GOOGLE_API_KEY")
-    if not API_KEY:
-        print("WARNING: KUCING_NAKAL_GOOGLE_API_KEY not set. Cannot use LLM features.")
-        return False
     try:
-        import google.generativeai as genai
-
-        genai.configure(api_key=API_KEY)
-        llm_model = genai.GenerativeModel("gemini-2.5-flash-preview-05-20")
-        print("LLM Initialized successfully.")
-        return True
+        llm_model = get_llm_model()
     except Exception as e:
         print(f"Failed to initialize LLM: {e}")
         return False
+    if not llm_model:
+        print("WARNING: KUCING_NAKAL_GOOGLE_API_KEY not set. Cannot use LLM features.")
+        return False
+    print("LLM Initialized successfully.")
+    return True
 
 
-def sanitize_filename(name):
-    name = re.sub(r'[\\/*?:"<>|]', "", name)
-    name = re.sub(r"^\.", "", name)
-    name = re.sub(r"\s+", " ", name).strip()
-    return name
+def write_file_atomic(filepath, data):
+    """Writes bytes via a temp file + rename, so a crash can't leave it half-written."""
+    fd, tmp_filepath = tempfile.mkstemp(dir=os.path.dirname(filepath), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_filepath, filepath)
+    except BaseException:
+        os.remove(tmp_filepath)
+        raise
 
 
-def basic_clean_text(text):
-    text = re.sub(
-        r"Read latest Chapters at novelbin\.com Only[.,!\s]*",
-        "",
-        text,
-        flags=re.IGNORECASE,
-    )
-    text = re.sub(
-        r"This chapter is updated by novelbin\.com[.,!\s]*",
-        "",
-        text,
-        flags=re.IGNORECASE,
-    )
-    text = re.sub(
-        r"Enhance your reading experience.*?Remove Ads From \$1",
-        "",
-        text,
-        flags=re.DOTALL,
-    )
-    return text.strip()
+def save_manifest(chapter_manifest, manifest_filepath):
+    """Writes the manifest atomically."""
+    write_file_atomic(manifest_filepath, dump_json(chapter_manifest))
 
 
-def chunk_text(text, max_chars=4000):
-    if len(text) <= max_chars:
-        return [text]
-    chunks, paragraphs, current_chunk = [], text.split("\n\n"), ""
-    for p in paragraphs:
-        if len(current_chunk) + len(p) + 2 <= max_chars:
-            current_chunk += ("\n\n" if current_chunk else "") + p
-        else:
-            if current_chunk:
-                chunks.append(current_chunk)
-            current_chunk = p
-    if current_chunk:
-        chunks.append(current_chunk)
-    return chunks
+# --- CORE LOGIC ACTIONS ---
 
 
-# --- CORE LOGIC ACTIONS ---
+async def fetch_chapter(semaphore, chapter_url):
+    """Fetches one chapter page and returns its title and cleaned text."""
+    async with semaphore:
+        chapter_html = await retry_with_backoff(
+            lambda: read_chapter_page(get_http_session(), chapter_url),
+            is_retryable_fetch_error,
+        )
+        await asyncio.sleep(random.uniform(1.2, 2.5))  # Randomized delay
+
+    tree = LexborHTMLParser(chapter_html)
+    title_element = tree.css_first("a.chr-title")
+    chapter_title = (
+        (title_element.attributes.get("title") or "").strip() if title_element else ""
+    )
 
+    content_div = tree.css_first("#chr-content")
+    if not content_div:
+        return chapter_title, None
+    # Drop inline ad scripts/styles so their source doesn't end up in the text
+    content_div.strip_tags(["script", "style"])
+    return chapter_title, basic_clean_text(content_div.text(separator="\n"))
 
-def action_download(novel_url):
+
+async def action_download(novel_url):
     """Action: Downloads and cleans a novel, resuming if it already exists."""
     print("--- Action: Download ---")
 
-    session = curl_requests.Session(impersonate="chrome120", timeout=30)
-
     try:
+        session = get_http_session()
         print(f"Fetching main page to get novel title: {novel_url}")
-        main_page = session.get(novel_url)
+        main_page = await session.get(novel_url)
         main_page.raise_for_status()
-        soup = BeautifulSoup(main_page.content, "html.parser")
+        soup = BeautifulSoup(main_page.content, "lxml", parse_only=MAIN_PAGE_STRAINER)
 
         novel_title = soup.find("h3", class_="title").text.strip()
         novel_folder = sanitize_filename(novel_title)
@@ -110,13 +127,12 @@ def action_download(novel_url):
 
         chapter_manifest = []
         start_chapter_count = 0
-        current_chapter_url = None
 
         if os.path.exists(manifest_filepath):
             print("Existing novel found. Attempting to resume download.")
-            with open(manifest_filepath, "r", encoding="utf-8") as f:
+            with open(manifest_filepath, "rb") as f:
                 try:
-                    chapter_manifest = json.load(f)
+                    chapter_manifest = load_json(f.read())
                 except json.JSONDecodeError:
                     print("Warning: Manifest file is corrupted. Starting from scratch.")
                     chapter_manifest = []
@@ -125,113 +141,118 @@ def action_download(novel_url):
                 last_chapter = chapter_manifest[-1]
                 start_chapter_count = last_chapter["number"]
 
-                # To resume, we need the URL of the last successfully scraped page.
-                # Let's add the URL to the manifest for future reliability.
+                # Resuming starts after the last saved chapter's URL.
                 if "url" not in last_chapter:
                     print(
                         "Warning: Older manifest format. Cannot reliably resume. Consider restarting."
                     )
                     return
 
-                last_chapter_url = last_chapter["url"]
                 print(
                     f"Last saved chapter was #{start_chapter_count}: {last_chapter['title']}"
                 )
-                print(
-                    f"Re-fetching last chapter's page to find the 'Next' link: {last_chapter_url}"
-                )
-
-                try:
-                    last_page = session.get(last_chapter_url)
-                    last_page_soup = BeautifulSoup(last_page.content, "html.parser")
-                    next_link_element = last_page_soup.find(id="next_chap")
-                    if next_link_element and "disabled" not in next_link_element.get(
-                        "class", []
-                    ):
-                        current_chapter_url = next_link_element.get("href")
-                        print(f"Resuming download from: {current_chapter_url}")
-                    else:
-                        print(
-                            "Last saved chapter was the final chapter. Download is complete."
-                        )
-                        return  # Exit, nothing more to do
-                except Exception as e:
-                    print(f"Could not fetch last chapter page to resume. Error: {e}")
-                    return
             else:
                 print("Manifest is empty. Starting from the beginning.")
 
-        if not current_chapter_url:
-            print("Starting download from the beginning.")
-            first_chapter_span = soup.select_one(
-                "span.nchr-text[data-novel_id][data-chapter_id]"
-            )
-            novel_id = first_chapter_span.get("data-novel_id")
-            chapter_id = first_chapter_span.get("data-chapter_id")
-            current_chapter_url = f"https://novelbin.com/b/{novel_id}/{chapter_id}"
-
-        chapter_count = start_chapter_count
-
-        while current_chapter_url:
-            if not current_chapter_url.startswith("http"):
-                current_chapter_url = urljoin(novel_url, current_chapter_url)
+        # Collect every chapter URL from the TOC so the pages can be
+        # fetched concurrently instead of following "Next" links.
+        first_chapter_span = soup.select_one(
+            "span.nchr-text[data-novel_id][data-chapter_id]"
+        )
+        novel_id = first_chapter_span.get("data-novel_id")
+        archive_page = await session.get(CHAPTER_ARCHIVE_URL.format(novel_id))
+        archive_page.raise_for_status()
+        archive_soup = BeautifulSoup(
+            archive_page.content, "lxml", parse_only=ARCHIVE_STRAINER
+        )
 
-            print(f"  Downloading Chapter {chapter_count + 1}...")
+        chapter_urls = [
+            urljoin(novel_url, link["href"])
+            for link in archive_soup.select("ul.list-chapter a[href]")
+        ]
+        pending_urls = chapter_urls
+        if chapter_manifest:
+            # Numbers continue from the last saved chapter, so only the
+            # chapters after it in the TOC are downloaded.
             try:
-                chapter_page = session.get(current_chapter_url)
-                chapter_page.raise_for_status()
-                chapter_soup = BeautifulSoup(chapter_page.content, "html.parser")
-
-                title_element = chapter_soup.find("a", class_="chr-title")
-                chapter_title = (
-                    title_element.get("title", f"Chapter {chapter_count + 1}").strip()
-                    if title_element
-                    else f"Chapter {chapter_count + 1}"
+                resume_index = chapter_urls.index(chapter_manifest[-1]["url"]) + 1
+            except ValueError:
+                print(
+                    "Warning: Last saved chapter is not in the table of contents. Cannot reliably resume."
                 )
+                return
+            pending_urls = chapter_urls[resume_index:]
+        if not pending_urls:
+            if chapter_manifest:
+                print("Last saved chapter was the final chapter. Download is complete.")
+            else:
+                print("Could not find any chapters in the table of contents.")
+            return
+        print(f"Chapters to download: {len(pending_urls)}")
 
-                safe_chapter_title = sanitize_filename(chapter_title)
-                chapter_filename = (
-                    f"{str(chapter_count + 1).zfill(4)}-{safe_chapter_title}.txt"
+        chapter_count = start_chapter_count
+        semaphore = asyncio.Semaphore(CONCURRENCY)
+        stopped = False
+
+        saved_count = len(chapter_manifest)
+        try:
+            for batch_start in range(0, len(pending_urls), BATCH_SIZE):
+                batch_urls = pending_urls[batch_start : batch_start + BATCH_SIZE]
+                results = await asyncio.gather(
+                    *(fetch_chapter(semaphore, url) for url in batch_urls),
+                    return_exceptions=True,
                 )
-                chapter_filepath = os.path.join(raw_folder, chapter_filename)
 
-                content_div = chapter_soup.find(id="chr-content")
-                if content_div:
-                    cleaned_text = basic_clean_text(
-                        content_div.get_text(separator="\n")
-                    )
-                    with open(chapter_filepath, "w", encoding="utf-8") as f:
-                        f.write(cleaned_text)
-
-                    # Add to manifest, including the URL for future resumes
-                    chapter_manifest.append(
-                        {
-                            "number": chapter_count + 1,
-                            "title": chapter_title,
-                            "file": chapter_filename,
-                            "url": current_chapter_url,  # IMPORTANT FOR RESUMING
-                        }
+                # Save in order and stop at the first failure, so the manifest
+                # never skips a chapter and the next run resumes from there.
+                for current_chapter_url, result in zip(batch_urls, results):
+                    if isinstance(result, curl_requests.errors.RequestsError):
+                        print(
+                            f"    ERROR on chapter {chapter_count + 1}: {result}. Stopping download."
+                        )
+                        stopped = True
+                        break
+                    if isinstance(result, Exception):
+                        raise result
+
+                    chapter_title, cleaned_text = result
+                    chapter_title = chapter_title or f"Chapter {chapter_count + 1}"
+                    print(f"  Downloaded Chapter {chapter_count + 1}: {chapter_title}")
+
+                    safe_chapter_title = sanitize_filename(chapter_title)
+                    chapter_filename = (
+                        f"{str(chapter_count + 1).zfill(4)}-{safe_chapter_title}.txt"
                     )
+                    chapter_filepath = os.path.join(raw_folder, chapter_filename)
+
+                    if cleaned_text is not None:
+                        with open(chapter_filepath, "wb") as f:
+                            f.write(cleaned_text.encode("utf-8"))
+
+                        # Add to manifest, including the URL for future resumes
+                        chapter_manifest.append(
+                            {
+                                "number": chapter_count + 1,
+                                "title": chapter_title,
+                                "file": chapter_filename,
+                                "url": current_chapter_url,  # IMPORTANT FOR RESUMING
+                            }
+                        )
 
-                    # Save the manifest after every successful chapter download
-                    with open(manifest_filepath, "w", encoding="utf-8") as f:
-                        json.dump(chapter_manifest, f, indent=2)
+                        # Save the manifest every few chapters; the finally
+                        # below writes the rest when the download ends
+                        if len(chapter_manifest) - saved_count >= MANIFEST_SAVE_EVERY:
+                            save_manifest(chapter_manifest, manifest_filepath)
+                            saved_count = len(chapter_manifest)
 
-                next_link_element = chapter_soup.find(id="next_chap")
-                current_chapter_url = (
-                    next_link_element.get("href")
-                    if next_link_element
-                    and "disabled" not in next_link_element.get("class", [])
-                    else None
-                )
-                time.sleep(random.uniform(1.2, 2.5))  # Randomized delay
-            except curl_requests.errors.RequestsError as e:
-                print(
-                    f"    ERROR on chapter {chapter_count + 1}: {e}. Stopping download."
-                )
-                break
+                    chapter_count += 1
 
-            chapter_count += 1
+                if stopped:
+                    break
+        finally:
+            # Flush whatever the periodic saves haven't written yet
+            if len(chapter_manifest) > saved_count:
+                save_manifest(chapter_manifest, manifest_filepath)
 
         print(
             f"--- Download Complete: Total scraped chapters in this run: {chapter_count - start_chapter_count} ---"
@@ -239,9 +260,44 @@ def action_download(novel_url):
 
     except Exception as e:
         print(f"Download action failed: {e}")
+    finally:
+        await close_http_session()
+
+
+async def llm_process_file(semaphore, raw_folder, llm_folder, filename, progress):
+    """Edits one raw chapter file with the LLM and saves the result."""
+    async with semaphore:
+        print(f"  Processing file {progress}: {filename}")
+        with open(os.path.join(raw_folder, filename), "r", encoding="utf-8") as f:
+            raw_text = f.read()
 
+        # A chapter edited before (a duplicate page, or a re-run after the
+        # llm_chapters folder was cleared) skips chunking and the API
+        llm_cache = get_llm_cache()
+        chapter_key = llm_chapter_cache_key(raw_text)
+        if chapter_key in llm_cache:
+            final_text = llm_cache[chapter_key]
+        else:
+            text_chunks = chunk_text(raw_text)
+            edited_chunks = await asyncio.gather(
+                *(llm_edit_text(chunk) for chunk in text_chunks)
+            )
+            final_text = "\n\n".join(edited_chunks)
+            # Only remember the chapter if no chunk fell back to its original
+            if all(
+                not chunk.strip() or llm_cache_key(chunk) in llm_cache
+                for chunk in text_chunks
+            ):
+                llm_cache[chapter_key] = final_text
+
+        # Atomic, so an interrupted run never leaves a partial file that the
+        # next run would skip as already processed
+        write_file_atomic(
+            os.path.join(llm_folder, filename), final_text.encode("utf-8")
+        )
 
-def action_llm_process(novel_folder):
+
+async def action_llm_process(novel_folder):
     """Action: Processes a downloaded novel with the LLM."""
     print(f"--- Action: LLM Process ---")
     print(f"Processing novel in folder: '{novel_folder}'")
@@ -260,41 +316,54 @@ def action_llm_process(novel_folder):
     raw_files = sorted([f for f in os.listdir(raw_folder) if f.endswith(".txt")])
     total_files = len(raw_files)
 
+    pending_files = []
     for i, filename in enumerate(raw_files):
         # Check if the file has already been processed to allow resuming
-        llm_filepath = os.path.join(llm_folder, filename)
-        if os.path.exists(llm_filepath):
+        if os.path.exists(os.path.join(llm_folder, filename)):
             print(
                 f"  Skipping file {i + 1}/{total_files} (already processed): {filename}"
             )
             continue
-
-        print(f"  Processing file {i + 1}/{total_files}: {filename}")
-        with open(os.path.join(raw_folder, filename), "r", encoding="utf-8") as f:
-            raw_text = f.read()
-
-        text_chunks = chunk_text(raw_text)
-        edited_chunks = [llm_edit_text(chunk) for chunk in text_chunks]
-        final_text = "\n\n".join(edited_chunks)
-
-        with open(llm_filepath, "w", encoding="utf-8") as f:
-            f.write(final_text)
+        pending_files.append((i, filename))
+
+    # Files run side by side; llm_limiter still caps the overall request rate
+    semaphore = asyncio.Semaphore(LLM_FILE_CONCURRENCY)
+    await asyncio.gather(
+        *(
+            llm_process_file(
+                semaphore, raw_folder, llm_folder, filename, f"{i + 1}/{total_files}"
+            )
+            for i, filename in pending_files
+        )
+    )
 
     print(f"--- LLM Processing Complete for {novel_folder} ---")
 
 
-def llm_edit_text(text_chunk):
+async def llm_edit_text(text_chunk):
     if not text_chunk.strip():
         return ""
     if not llm_model:
         raise ConnectionError("LLM not initialized.")
+    llm_cache = get_llm_cache()
+    cache_key = llm_cache_key(text_chunk)
+    if cache_key in llm_cache:
+        return llm_cache[cache_key]
+
+    # The editing prompt is the model's system instruction, so the chunk is
+    # passed on its own as the user content
+    async def generate():
+        async with llm_limiter:  # Respect free tier rate limits
+            return await llm_model.generate_content_async(
+                text_chunk, request_options={"timeout": 120}
+            )
+
     try:
-        full_prompt = EDITING_PROMPT.format(text_chunk)
-        response = llm_model.generate_content(
-            full_prompt, request_options={"timeout": 120}
-        )
-        time.sleep(1.5)
-        return response.text if response.parts else text_chunk
+        response = await retry_with_backoff(generate, is_retryable_llm_error)
+        if not response.parts:
+            return text_chunk
+        llm_cache[cache_key] = response.text
+        return response.text
     except Exception as e:
         print(f"    > LLM ERROR: {e}. Returning original chunk.")
         return text_chunk
@@ -304,34 +373,41 @@ def action_update_git():
     """Action: Updates manifests and pushes all changes to Git."""
     print("--- Action: Update and Push ---")
     print("Updating main manifest...")
-    novels = [
-        d
-        for d in os.listdir(REPO_PATH)
-        if os.path.isdir(os.path.join(REPO_PATH, d))
-        and not d.startswith((".", "venv"))
-        and os.path.exists(os.path.join(REPO_PATH, d, "manifest.json"))
-    ]
-    with open(os.path.join(REPO_PATH, "manifest.json"), "w") as f:
-        json.dump(novels, f, indent=2)
+    # scandir's entries carry the file type, so only folders that pass the
+    # name filter cost a stat for their manifest.
+    with os.scandir(REPO_PATH) as entries:
+        novels = [
+            entry.name
+            for entry in entries
+            if entry.is_dir(follow_symlinks=False)
+            and not entry.name.startswith((".", "venv"))
+            and os.path.exists(os.path.join(entry.path, "manifest.json"))
+        ]
+    with open(os.path.join(REPO_PATH, "manifest.json"), "wb") as f:
+        f.write(dump_json(novels))
     print("Main manifest updated.")
 
     try:
-        repo = git.Repo(REPO_PATH)
-        if not repo.is_dirty(untracked_files=True):
+        print("Adding changes to Git...")
+        subprocess.run(["git", "-C", REPO_PATH, "add", "-A"], check=True)
+        # Exits 0 when the index matches HEAD, i.e. there is nothing to commit
+        staged = subprocess.run(["git", "-C", REPO_PATH, "diff", "--cached", "--quiet"])
+        if staged.returncode == 0:
             print("No changes to commit.")
             return
-        print("Adding changes to Git...")
-        repo.git.add(A=True)
         commit_message = (
             f"Automated novel update - {time.strftime('%Y-%m-%d %H:%M:%S')}"
         )
-        repo.index.commit(commit_message)
+        subprocess.run(
+            ["git", "-C", REPO_PATH, "commit", "-m", commit_message], check=True
+        )
         print(f"Committed changes: '{commit_message}'")
-        origin = repo.remote(name="origin")
         print("Pushing to remote...")
-        origin.push()
+        subprocess.run(["git", "-C", REPO_PATH, "push", "origin", "HEAD"], check=True)
         print("Push successful.")
-    except Exception as e:
+    except FileNotFoundError:
+        print("git executable not found. Skipping git operations.")
+    except subprocess.CalledProcessError as e:
         print(f"Git operation failed: {e}")
 
 
@@ -369,9 +445,9 @@ def main():
     args = parser.parse_args()
 
     if args.action == "download":
-        action_download(args.url)
+        asyncio.run(action_download(args.url))
     elif args.action == "llm":
-        action_llm_process(args.folder)
+        asyncio.run(action_llm_process(args.folder))
     elif args.action == "update":
         action_update_git()
 
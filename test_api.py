@@ -48,13 +48,16 @@ payload = {
     ]
 }
 
-print("\nSending request to list models...")
+# One client for both requests, so the second reuses the first one's
+# connection (keep-alive) instead of paying for a new TLS handshake.
+# http2=True needs the optional "h2" package (pip install "httpx[http2]").
+with httpx.Client(timeout=30.0, http2=True) as client:
+    print("\nSending request to list models...")
 
-# --- 3. Send the request using httpx ---
-try:
-    with httpx.Client(timeout=20.0) as client:
+    # --- 3. Send the request using httpx ---
+    try:
         # We use a GET request for listing resources
-        response = client.get(LIST_MODELS_URL, params=params)
+        response = client.get(LIST_MODELS_URL, params=params, timeout=20.0)
         response.raise_for_status()
 
         response_data = response.json()
@@ -81,20 +84,19 @@ try:
                     print("  > ❌ This model CANNOT be used for our scraper.")
             print("\n--------------------------------------------")
 
-except httpx.HTTPStatusError as e:
-    print(
-        f"\n[FAILURE] ❌ An HTTP error occurred: Status Code {e.response.status_code}"
-    )
-    print("Please check your API key and permissions.")
-    print(f"Full error response: {e.response.text}")
-except httpx.RequestError as e:
-    print(f"\n[FAILURE] ❌ A network request error occurred: {e}")
+    except httpx.HTTPStatusError as e:
+        print(
+            f"\n[FAILURE] ❌ An HTTP error occurred: Status Code {e.response.status_code}"
+        )
+        print("Please check your API key and permissions.")
+        print(f"Full error response: {e.response.text}")
+    except httpx.RequestError as e:
+        print(f"\n[FAILURE] ❌ A network request error occurred: {e}")
 
-print("\nPreparing to send a direct HTTP request to the Gemini API...")
+    print("\nPreparing to send a direct HTTP request to the Gemini API...")
 
-# --- 3. Send the request using httpx ---
-try:
-    with httpx.Client(timeout=30.0) as client:
+    # --- 3. Send the request using httpx ---
+    try:
         # We use a POST request as required by the API
         response = client.post(
             GEMINI_API_URL,
@@ -126,29 +128,29 @@ try:
             print("Full response JSON:")
             print(json.dumps(response_data, indent=2))
 
-except httpx.HTTPStatusError as e:
-    # This block catches specific HTTP errors like 400, 403, 429, etc.
-    print(
-        f"\n[FAILURE] ❌ An HTTP error occurred: Status Code {e.response.status_code}"
-    )
-    print(
-        "This often means the API key is invalid, expired, or the API is not enabled."
-    )
-    # Print the error details from the API response if available
-    try:
-        error_details = e.response.json()
-        print("\n--- Error Details from API ---")
-        print(json.dumps(error_details, indent=2))
-        print("------------------------------")
-    except json.JSONDecodeError:
-        print("Could not parse error details from the response body.")
-        print(f"Raw response body: {e.response.text}")
-
-except httpx.RequestError as e:
-    # This block catches network-level errors (DNS, connection timeout, etc.)
-    print(f"\n[FAILURE] ❌ A network request error occurred: {e}")
-    print("Check your internet connection and if the URL is correct.")
-
-except Exception as e:
-    # Catch any other unexpected errors
-    print(f"\n[FAILURE] ❌ An unexpected error occurred: {e}")
+    except httpx.HTTPStatusError as e:
+        # This block catches specific HTTP errors like 400, 403, 429, etc.
+        print(
+            f"\n[FAILURE] ❌ An HTTP error occurred: Status Code {e.response.status_code}"
+        )
+        print(
+            "This often means the API key is invalid, expired, or the API is not enabled."
+        )
+        # Print the error details from the API response if available
+        try:
+            error_details = e.response.json()
+            print("\n--- Error Details from API ---")
+            print(json.dumps(error_details, indent=2))
+            print("------------------------------")
+        except json.JSONDecodeError:
+            print("Could not parse error details from the response body.")
+            print(f"Raw response body: {e.response.text}")
+
+    except httpx.RequestError as e:
+        # This block catches network-level errors (DNS, connection timeout, etc.)
+        print(f"\n[FAILURE] ❌ A network request error occurred: {e}")
+        print("Check your internet connection and if the URL is correct.")
+
+    except Exception as e:
+        # Catch any other unexpected errors
+        print(f"\n[FAILURE] ❌ An unexpected error occurred: {e}")
@@ -1,61 +0,0 @@
-# test_scraper.py (Corrected and Final Version)
-
-import unittest
-from unittest.mock import patch, MagicMock
-import scraper
-
-
-class TestHelperFunctions(unittest.TestCase):
-    def test_sanitize_filename(self):
-        self.assertEqual(scraper.sanitize_filename("A*B/C:D<E>F|G?H"), "ABCDEFGH")
-
-    def test_basic_clean_text(self):
-        text1 = "Hello World. This chapter is updated by novelbin.com"
-        expected1 = "Hello World."
-        self.assertEqual(scraper.basic_clean_text(text1), expected1)
-
-        text2 = "Read latest Chapters at novelbin.com Only. The story begins."
-        expected2 = "The story begins."
-        self.assertEqual(scraper.basic_clean_text(text2), expected2)
-
-
-# A separate class for tests that require mocking the LLM
-class TestLLMFunctions(unittest.TestCase):
-    # This patch now correctly finds the 'llm_model' variable in the 'scraper' module
-    @patch("scraper.llm_model")
-    def test_llm_edit_text_success(self, mock_llm_model):
-        """Tests the LLM editing function's success path."""
-        # We need to handle the case where the model might not be initialized (if API key is missing)
-        # For this test, we ensure the mock is not None.
-        self.assertIsNotNone(
-            mock_llm_model, "Mock LLM model should not be None for this test"
-        )
-
-        mock_response = MagicMock()
-        mock_response.text = "This is the corrected text."
-        mock_response.parts = [mock_response.text]
-        mock_llm_model.generate_content.return_value = mock_response
-
-        edited_text = scraper.llm_edit_text("This is the incorect text.")
-
-        mock_llm_model.generate_content.assert_called_once()
-        self.assertEqual(edited_text, "This is the corrected text.")
-
-    @patch("scraper.llm_model")
-    def test_llm_edit_text_api_failure(self, mock_llm_model):
-        """Tests that the original text is returned if the LLM API call fails."""
-        self.assertIsNotNone(
-            mock_llm_model, "Mock LLM model should not be None for this test"
-        )
-
-        mock_llm_model.generate_content.side_effect = Exception("API limit reached")
-
-        original_text = "This text will be returned as-is."
-        edited_text = scraper.llm_edit_text(original_text)
-
-        self.assertEqual(edited_text, original_text)
-        mock_llm_model.generate_content.assert_called_once()
-
-
-if __name__ == "__main__":
-    unittest.main()
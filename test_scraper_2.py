@@ -1,65 +1,434 @@
 # test_scraper.py (Corrected and Improved Version)
 
-import unittest
-from unittest.mock import patch, MagicMock
-import scraper  # Import our main script
-
-
-class TestHelperFunctions(unittest.TestCase):
-    # This test does NOT need the LLM. It runs completely on its own.
-    def test_sanitize_filename(self):
-        """Tests that invalid characters are removed from filenames."""
-        self.assertEqual(scraper.sanitize_filename("A*B/C:D<E>F|G?H"), "ABCDEFGH")
-        self.assertEqual(scraper.sanitize_filename("Valid-Name_123"), "Valid-Name_123")
-
-    # This test also does NOT need the LLM.
-    def test_basic_clean_text(self):
-        """Tests the basic regex-based text cleaning."""
-        # Test case 1
-        text1 = "Hello World. This chapter is updated by novelbin.com"
-        expected1 = "Hello World."
-        self.assertEqual(scraper.basic_clean_text(text1), expected1)
-
-        # Test case 2 (The one that was failing)
-        text2 = "Read latest Chapters at novelbin.com Only. The story begins."
-        expected2 = "The story begins."
-        self.assertEqual(scraper.basic_clean_text(text2), expected2)
-
-
-# A separate class for tests that require mocking the LLM
-class TestLLMFunctions(unittest.TestCase):
-    # The @patch decorator now correctly applies ONLY to the tests in this class.
-    # It replaces 'scraper.llm_model' with a mock for the duration of each test.
-    @patch("scraper.llm_model")
-    def test_llm_edit_text_success(self, mock_llm_model):
-        """Tests the LLM editing function's success path."""
-        # Configure the mock to simulate a successful API call
-        mock_response = MagicMock()
-        mock_response.text = "This is the corrected text."
-        mock_response.parts = [mock_response.text]
-        mock_llm_model.generate_content.return_value = mock_response
-
-        original_text = "This is the incorect text."
-        edited_text = scraper.llm_edit_text(original_text)
-
-        mock_llm_model.generate_content.assert_called_once()
-        self.assertEqual(edited_text, "This is the corrected text.")
-
-    @patch("scraper.llm_model")
-    def test_llm_edit_text_api_failure(self, mock_llm_model):
-        """Tests that the original text is returned if the LLM API call fails."""
-        # Configure the mock to simulate an API error
-        mock_llm_model.generate_content.side_effect = Exception("API limit reached")
-
-        original_text = "This text will be returned as-is."
-        # We need to explicitly call the function to test it
-        edited_text = scraper.llm_edit_text(original_text)
-
-        # Assert that the function returns the original text upon failure
-        self.assertEqual(edited_text, original_text)
-        # Also assert that the mock was actually called
-        mock_llm_model.generate_content.assert_called_once()
-
-
-if __name__ == "__main__":
-    unittest.main()
+import asyncio
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from unittest.mock import AsyncMock
+import pytest
+import novel_utils
+from curl_cffi import requests as curl_requests
+from google.api_core.exceptions import ResourceExhausted
+
+# What the mocked model returns for a successful edit; tests only read it
+OK_RESPONSE = SimpleNamespace(
+    text="This is the corrected text.", parts=["This is the corrected text."]
+)
+
+# scraper itself comes from the session-scoped scraper_mod fixture in
+# conftest.py, which imports it once with the Gemini SDK stubbed out.
+
+
+# These tests do NOT need the LLM. Each case runs as its own test item.
+@pytest.mark.parametrize(
+    "name, expected",
+    [
+        ("A*B/C:D<E>F|G?H", "ABCDEFGH"),
+        ("Valid-Name_123", "Valid-Name_123"),
+        ("", ""),
+        (".hidden", "hidden"),
+        ("Chapter 1:  The   Start", "Chapter 1 The Start"),
+        ('Say "Hi"\\', "Say Hi"),
+    ],
+)
+def test_sanitize_filename(scraper_mod, name, expected):
+    """Tests that invalid characters are removed from filenames."""
+    assert scraper_mod.sanitize_filename(name) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("Hello World. This chapter is updated by novelbin.com", "Hello World."),
+        # The one that was failing
+        (
+            "Read latest Chapters at novelbin.com Only. The story begins.",
+            "The story begins.",
+        ),
+        ("READ LATEST CHAPTERS AT NOVELBIN.COM ONLY! Text", "Text"),
+        # Lexbor turns &nbsp; into U+00A0; removed with either regex engine
+        ("x Read latest Chapters at novelbin.com Only.\xa0 y", "x y"),
+        # Other Unicode spaces that RE2's \s doesn't match either
+        ("a Read latest Chapters at novelbin.com Only. \u2009\u3000\u202f b", "a b"),
+        ("a This chapter is updated by novelbin.com\u2028\u3000b", "a b"),
+        (
+            "Start. Enhance your reading experience by removing ads\n"
+            "for only Remove Ads From $1 End.",
+            "Start.  End.",
+        ),
+    ],
+)
+def test_basic_clean_text(scraper_mod, text, expected):
+    """Tests the basic regex-based text cleaning."""
+    assert scraper_mod.basic_clean_text(text) == expected
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("aaaa\n\nbbbb\n\ncccc", ["aaaa\n\nbbbb", "cccc"]),
+        # A paragraph longer than max_chars is kept whole
+        ("a" * 12 + "\n\nbb", ["a" * 12, "bb"]),
+        # A longer blank run at a cut keeps its extra newlines
+        ("aaaa\n\n\nbbbb\n\ncccc", ["aaaa", "\nbbbb", "cccc"]),
+        ("aaaa\n\n\n\nbbbb", ["aaaa", "\n\nbbbb"]),
+    ],
+)
+def test_chunk_text(scraper_mod, text, expected):
+    """Tests that text is split at paragraph breaks within max_chars."""
+    chunks = scraper_mod.chunk_text(text, max_chars=10)
+    assert chunks == expected
+    # Joining the edited chunks back up restores the paragraph spacing
+    assert "\n\n".join(chunks) == text
+
+
+class FakeStreamedPage:
+    """Streams the given chunks, counting how many were read."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.read = 0
+        self.quit_now = asyncio.Event()
+
+    def stream(self, method, url):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def raise_for_status(self):
+        pass
+
+    async def aiter_content(self):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+@pytest.mark.parametrize(
+    "chunks, expected_read, aborted",
+    [
+        # Both markers split across chunks: stops once next_chap completes
+        (
+            [b'<div id="chr-con', b'tent">text</div><a id="next_', b'chap">', b"tail"],
+            3,
+            True,
+        ),
+        # A next_chap link before the chapter text doesn't end the download
+        (
+            [
+                b'<a id="next_chap">',
+                b'<div id="chr-content">text</div>',
+                b'<a id="next_chap">',
+                b"tail",
+            ],
+            3,
+            True,
+        ),
+        # Neither marker: the whole page is read
+        ([b"<html>", b"no chapter", b"</html>"], 3, False),
+    ],
+)
+def test_read_chapter_page_stops_after_content(
+    scraper_mod, chunks, expected_read, aborted
+):
+    """Tests that a chapter page is only read up to the "Next" link after its text."""
+    page = FakeStreamedPage(chunks)
+
+    body = asyncio.run(scraper_mod.read_chapter_page(page, "https://novelbin.com/c1"))
+
+    assert page.read == expected_read
+    assert body == b"".join(chunks[:expected_read])
+    assert page.quit_now.is_set() == aborted
+
+
+def test_cli_fetch_chapter_stops_after_content(scraper_cli_mod, monkeypatch):
+    """Tests that scraper_cli parses the page that was cut short after the text."""
+    page = FakeStreamedPage(
+        [
+            b'<a class="chr-title" title="Chapter 1">Chapter 1</a>',
+            b'<div id="chr-content"><p>Hello</p></div><a id="next_chap">Next</a>',
+            b"<div>comments</div>",
+        ]
+    )
+    monkeypatch.setattr(scraper_cli_mod, "get_http_session", lambda: page)
+    # No randomized politeness delay in tests
+    monkeypatch.setattr(
+        scraper_cli_mod, "random", SimpleNamespace(uniform=lambda a, b: 0)
+    )
+
+    result = asyncio.run(
+        scraper_cli_mod.fetch_chapter(asyncio.Semaphore(1), "https://novelbin.com/c1")
+    )
+
+    assert result == ("Chapter 1", "Hello")
+    assert page.read == 2
+    assert page.quit_now.is_set()
+
+
+class SlowChapterHandler(BaseHTTPRequestHandler):
+    """Sends the chapter text at once, then a long tail in slow pieces."""
+
+    tail_pieces = 30
+    # Set per test to threading.Events
+    sent_whole_page = None
+    finished = None
+
+    def do_GET(self):
+        head = b'<div id="chr-content">text</div><a id="next_chap">'
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(head) + self.tail_pieces * 20000))
+        self.end_headers()
+        self.wfile.write(head)
+        self.wfile.flush()
+        try:
+            for _ in range(self.tail_pieces):
+                time.sleep(0.05)
+                self.wfile.write(b"x" * 20000)
+                self.wfile.flush()
+            self.sent_whole_page.set()
+        except OSError:
+            pass  # The client aborted the transfer
+        finally:
+            self.finished.set()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def test_read_chapter_page_aborts_transfer(scraper_mod):
+    """Tests that the early stop really cuts the download short."""
+    SlowChapterHandler.sent_whole_page = threading.Event()
+    SlowChapterHandler.finished = threading.Event()
+    server = ThreadingHTTPServer(("127.0.0.1", 0), SlowChapterHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    async def read():
+        async with curl_requests.AsyncSession() as session:
+            return await scraper_mod.read_chapter_page(
+                session, f"http://127.0.0.1:{server.server_port}/"
+            )
+
+    try:
+        body = asyncio.run(read())
+        SlowChapterHandler.finished.wait(timeout=5)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+    assert body.endswith(b'id="next_chap">')
+    assert not SlowChapterHandler.sent_whole_page.is_set()
+
+
+# Tests that need the LLM take the llm_model fixture from conftest.py: one mock
+# model shared by the session, reset before each test.
+def test_llm_edit_text_success(scraper_mod, llm_model):
+    """Tests the LLM editing function's success path."""
+    # Configure the mock to simulate a successful API call
+    llm_model.generate_content_async.return_value = OK_RESPONSE
+
+    original_text = "This is the incorect text."
+    edited_text = asyncio.run(scraper_mod.llm_edit_text(original_text))
+
+    llm_model.generate_content_async.assert_called_once()
+    assert edited_text == "This is the corrected text."
+
+
+def test_llm_edit_text_api_failure(scraper_mod, llm_model):
+    """Tests that the original text is returned if the LLM API call fails."""
+    # Configure the mock to simulate an API error
+    llm_model.generate_content_async.side_effect = Exception("API limit reached")
+
+    original_text = "This text will be returned as-is."
+    edited_text = asyncio.run(scraper_mod.llm_edit_text(original_text))
+
+    # Assert that the function returns the original text upon failure
+    assert edited_text == original_text
+    # Also assert that the mock was actually called
+    llm_model.generate_content_async.assert_called_once()
+
+
+def test_llm_edit_text_cache_hit(scraper_mod, llm_model):
+    """Tests that a cached edit is returned without calling the LLM again."""
+    llm_model.generate_content_async.return_value = OK_RESPONSE
+
+    first = asyncio.run(scraper_mod.llm_edit_text("This is the incorect text."))
+    second = asyncio.run(scraper_mod.llm_edit_text("This is the incorect text."))
+
+    assert first == second
+    llm_model.generate_content_async.assert_called_once()
+
+
+def test_llm_edit_text_retries_rate_limit(scraper_mod, llm_model, monkeypatch):
+    """Tests that a 429 from the API is retried instead of giving up."""
+    mock_sleep = AsyncMock()
+    monkeypatch.setattr(novel_utils, "backoff_sleep", mock_sleep)
+    llm_model.generate_content_async.side_effect = [
+        ResourceExhausted("Quota exceeded"),
+        OK_RESPONSE,
+    ]
+
+    edited_text = asyncio.run(scraper_mod.llm_edit_text("This is the incorect text."))
+
+    assert edited_text == "This is the corrected text."
+    assert llm_model.generate_content_async.call_count == 2
+    mock_sleep.assert_awaited_once()
+
+
+def fake_fetch_chapter(calls):
+    """Returns a fetch_chapter stand-in that records each fetch in calls."""
+
+    async def fetch_chapter(session, semaphore, chapter_url):
+        calls.append(chapter_url)
+        return "Chapter One", "text c1"
+
+    return fetch_chapter
+
+
+async def scrape_c1(scraper_mod, novel_folder, previous_entry=None, refetch=False):
+    """Runs scrape_chapter for chapter #1 of a fake novel."""
+    return await scraper_mod.scrape_chapter(
+        None,
+        asyncio.Semaphore(1),
+        str(novel_folder),
+        1,
+        "https://novelbin.com/c1",
+        previous_entry,
+        refetch=refetch,
+    )
+
+
+# Each scrape_c1 call stands in for one run of the scraper; a test's runs share
+# one event loop, which the llm_limiter is bound to.
+def test_scrape_chapter_skips_saved_and_unchanged_chapters(
+    scraper_mod, llm_model, tmp_path, monkeypatch
+):
+    """Tests that saved chapters are resumed and unchanged text isn't re-edited."""
+    fetches = []
+    monkeypatch.setattr(scraper_mod, "fetch_chapter", fake_fetch_chapter(fetches))
+    llm_model.generate_content_async.return_value = OK_RESPONSE
+
+    async def runs():
+        entry = await scrape_c1(scraper_mod, tmp_path)
+        assert entry["edited"] is True
+        assert (tmp_path / entry["file"]).read_text() == "This is the corrected text."
+
+        # Saved and edited: resumed without fetching the page again
+        assert await scrape_c1(scraper_mod, tmp_path, entry) is entry
+        assert len(fetches) == 1
+
+        # Fetched again, but the text is unchanged: the edited file is kept
+        assert await scrape_c1(scraper_mod, tmp_path, entry, refetch=True) is entry
+        assert len(fetches) == 2
+
+    asyncio.run(runs())
+    llm_model.generate_content_async.assert_called_once()
+
+
+def test_scrape_chapter_redoes_failed_llm_edit(
+    scraper_mod, llm_model, tmp_path, monkeypatch
+):
+    """Tests that a chapter whose LLM edit failed is edited on the next run."""
+    fetches = []
+    monkeypatch.setattr(scraper_mod, "fetch_chapter", fake_fetch_chapter(fetches))
+    llm_model.generate_content_async.side_effect = Exception("API limit reached")
+
+    async def runs():
+        entry = await scrape_c1(scraper_mod, tmp_path)
+        assert entry["edited"] is False
+        assert (tmp_path / entry["file"]).read_text() == "text c1"
+
+        llm_model.generate_content_async.side_effect = None
+        llm_model.generate_content_async.return_value = OK_RESPONSE
+        entry = await scrape_c1(scraper_mod, tmp_path, entry)
+        assert len(fetches) == 2
+        assert entry["edited"] is True
+        assert (tmp_path / entry["file"]).read_text() == "This is the corrected text."
+
+    asyncio.run(runs())
+
+
+# The download tests run against a fake novelbin: chapter URLs are /c1, /c2,
+# ... and a chapter listed in MISSING has no #chr-content on its page.
+NOVEL_PAGE = (
+    b'<h3 class="title">Test Novel</h3>'
+    b'<span class="nchr-text" data-novel_id="n1" data-chapter_id="1"></span>'
+)
+
+
+class FakeNovelSession:
+    """Serves the novel page and a chapter archive of the first N chapters."""
+
+    def __init__(self, chapter_count):
+        self.chapter_count = chapter_count
+
+    async def get(self, url):
+        if "chapter-archive" in url:
+            links = "".join(
+                f'<li><a href="/c{n}">Chapter {n}</a></li>'
+                for n in range(1, self.chapter_count + 1)
+            )
+            content = f'<ul class="list-chapter">{links}</ul>'.encode()
+        else:
+            content = NOVEL_PAGE
+        return SimpleNamespace(content=content, raise_for_status=lambda: None)
+
+
+def test_action_download_resumes_after_chapter_without_content(
+    scraper_cli_mod, tmp_path, monkeypatch
+):
+    """Tests that a resume only fetches chapters after the last saved one."""
+    fetched = []
+
+    async def fake_fetch_chapter(semaphore, url):
+        name = url.rsplit("/", 1)[-1]
+        fetched.append(name)
+        return f"T{name}", None if name == "c2" else f"text {name}"
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraper_cli_mod, "fetch_chapter", fake_fetch_chapter)
+    monkeypatch.setattr(scraper_cli_mod, "close_http_session", AsyncMock())
+
+    for chapter_count in (4, 5):
+        session = FakeNovelSession(chapter_count)
+        monkeypatch.setattr(scraper_cli_mod, "get_http_session", lambda: session)
+        asyncio.run(scraper_cli_mod.action_download("https://novelbin.com/n/test/"))
+
+    assert fetched == ["c1", "c2", "c3", "c4", "c5"]
+    assert sorted(os.listdir(tmp_path / "Test Novel" / "raw_chapters")) == [
+        "0001-Tc1.txt",
+        "0003-Tc3.txt",
+        "0004-Tc4.txt",
+        "0005-Tc5.txt",
+    ]
+    manifest = json.loads((tmp_path / "Test Novel" / "manifest.json").read_bytes())
+    assert [entry["number"] for entry in manifest] == [1, 3, 4, 5]
+
+
+def test_scrape_novel_keeps_chapters_saved_before_an_error(
+    scraper_mod, tmp_path, monkeypatch
+):
+    """Tests that one failing chapter doesn't drop the others from the manifest."""
+
+    async def fetch_chapter(session, semaphore, chapter_url):
+        name = chapter_url.rsplit("/", 1)[-1]
+        if name == "c2":
+            raise OSError("disk full")
+        return f"T{name}", f"text {name}"
+
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(scraper_mod, "fetch_chapter", fetch_chapter)
+    monkeypatch.setattr(scraper_mod, "USE_LLM_CLEANUP", False)
+
+    asyncio.run(
+        scraper_mod.scrape_novel("https://novelbin.com/n/test/", FakeNovelSession(3))
+    )
+
+    manifest = json.loads((tmp_path / "Test Novel" / "manifest.json").read_bytes())
+    assert [entry["file"] for entry in manifest] == ["0001-Tc1.txt", "0003-Tc3.txt"]